@@ -45,7 +45,7 @@ drawer.add_biome(base_drawer.Biome(checker=All(), sprite=hex_grid.Sprite(RGBA(0,
 # generator
 ###########
 
-topology = Topology(coordinates=hex_grid.cells_hexagon(40))
+topology = hex_grid.HexagonTopology(radius=40)
 
 space = Space(topology, recorders=[drawer])
 space.initialize(node_fabric.Node(DEAD))
@@ -65,13 +65,11 @@ for i in range(STEPS):
     print(f'step {i+1}/{STEPS}')
 
     with space.step():
-        for node in space.base(ALIVE):
-            if hex_grid.Ring(node).base(ALIVE) | ~Between(2, 3):
-                node <<= DEAD
+        alive = space.mask(ALIVE)
+        neighbours = space.count_neighbours(hex_grid.Ring, ALIVE)
 
-        for node in space.base(DEAD):
-            if hex_grid.Ring(node).base(ALIVE) | Count(3):
-                node <<= ALIVE
+        space.assign(alive & ~Between(2, 3).mask(neighbours), DEAD)
+        space.assign(~alive & Count(3).mask(neighbours), ALIVE)
 
 
 drawer.finish()
@@ -45,7 +45,7 @@ drawer.add_biome(base_drawer.Biome(checker=All(), sprite=square_grid.Sprite(RGBA
 # generator
 ###########
 
-topology = Topology(coordinates=square_grid.cells_rectangle(width=WIDTH, height=HEIGHT))
+topology = square_grid.RectangleTopology(width=WIDTH, height=HEIGHT)
 
 space = Space(topology, recorders=[drawer])
 space.initialize(node_fabric.Node(DEAD))
@@ -65,13 +65,11 @@ for i in range(STEPS):
     print(f'step {i+1}/{STEPS}')
 
     with space.step():
-        for node in space.base(ALIVE):
-            if square_grid.Ring(node).base(ALIVE) | ~Between(2, 3):
-                node <<= DEAD
+        alive = space.mask(ALIVE)
+        neighbours = space.count_neighbours(square_grid.Ring, ALIVE)
 
-        for node in space.base(DEAD):
-            if square_grid.Ring(node).base(ALIVE) | Count(3):
-                node <<= ALIVE
+        space.assign(alive & ~Between(2, 3).mask(neighbours), DEAD)
+        space.assign(~alive & Count(3).mask(neighbours), ALIVE)
 
 
 drawer.finish()
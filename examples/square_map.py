@@ -4,7 +4,6 @@ import enum
 from pcg import nodes
 from pcg import colors
 from pcg import geometry
-from pcg import topologies
 from pcg.space import Space
 from pcg import drawer as base_drawer
 from pcg.grids import square as square_grid
@@ -49,7 +48,7 @@ drawer.add_biome(base_drawer.Biome(checker=All(), sprite=square_grid.Sprite(colo
 # generator
 ###########
 
-topology = topologies.Topology(coordinates=square_grid.cells_rectangle(width=80, height=80))
+topology = square_grid.RectangleTopology(width=80, height=80)
 
 space = Space(topology, recorders=[drawer])
 space.initialize(node_fabric.Node(GRASS))
@@ -65,9 +64,8 @@ with space.step():
             node <<= WATER
 
 with space.step():
-    for node in space.base(GRASS):
-        if square_grid.Ring(node).base(WATER) | Exists():
-            node <<= SAND
+    near_water = Exists().mask(space.count_neighbours(square_grid.Ring, WATER))
+    space.assign(space.mask(GRASS) & near_water, SAND)
 
 for _ in range(3):
     with space.step():
@@ -1,7 +1,11 @@
-
 import random
 import itertools
 
+import numpy
+
+from .filters import fuse
+from .topologies import Selection, lengths_offsets, segments_sums
+
 
 class Aggregator:
     __slots__ = ()
@@ -9,6 +13,46 @@ class Aggregator:
     def __invert__(self):
         return Inverter(self)
 
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def values(self, nodes, filter):
+        return fuse(filter).mask(nodes)
+
+    def values_key(self, filter):
+        # aggregators with equal keys count the same values
+        return filter
+
+    def counts(self, connectome, nodes, filter, indexes=None):
+        if indexes is None:
+            return connectome.count(self.values(nodes, filter))
+
+        # filter is checked only in areas of requested nodes
+        neighbours = nodes.subset(connectome.neighbours(indexes))
+
+        return segments_sums(self.values(neighbours, filter), lengths_offsets(connectome.degrees(indexes)))
+
+    # with indexes only their areas are checked
+    def bulk(self, connectome, nodes, filter, indexes=None):
+        if hasattr(connectome, 'shared_counts'):
+            counts = connectome.shared_counts(self, nodes, filter, indexes)
+        else:
+            counts = self.counts(connectome, nodes, filter, indexes)
+
+        return self.mask(counts, connectome.degrees(indexes))
+
+
+def selection_total(selection):
+    total = getattr(selection, 'total', None)
+
+    if total is None:
+        raise ValueError('aggregator requires selection with known size, like BaseArea.base() result')
+
+    return total
+
 
 class Inverter(Aggregator):
     __slots__ = ('base',)
@@ -19,6 +63,48 @@ class Inverter(Aggregator):
     def __ror__(self, other):
         return not self.base.__ror__(other)
 
+    def mask(self, counts, totals=None):
+        return ~self.base.mask(counts, totals)
+
+    def bulk(self, connectome, nodes, filter, indexes=None):
+        return ~self.base.bulk(connectome, nodes, filter, indexes)
+
+
+class And(Aggregator):
+    __slots__ = ('left', 'right')
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+
+    def __ror__(self, other):
+        other = Selection.materialize(other)
+        return (other | self.left) and (other | self.right)
+
+    def mask(self, counts, totals=None):
+        return self.left.mask(counts, totals) & self.right.mask(counts, totals)
+
+    def bulk(self, connectome, nodes, filter, indexes=None):
+        return self.left.bulk(connectome, nodes, filter, indexes) & self.right.bulk(connectome, nodes, filter, indexes)
+
+
+class Or(Aggregator):
+    __slots__ = ('left', 'right')
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+
+    def __ror__(self, other):
+        other = Selection.materialize(other)
+        return (other | self.left) or (other | self.right)
+
+    def mask(self, counts, totals=None):
+        return self.left.mask(counts, totals) | self.right.mask(counts, totals)
+
+    def bulk(self, connectome, nodes, filter, indexes=None):
+        return self.left.bulk(connectome, nodes, filter, indexes) | self.right.bulk(connectome, nodes, filter, indexes)
+
 
 class Count(Aggregator):
     __slots__ = ('number',)
@@ -37,6 +123,9 @@ class Count(Aggregator):
 
         return self.number == count
 
+    def mask(self, counts, totals=None):
+        return counts == self.number
+
 
 class Between(Aggregator):
     __slots__ = ('min', 'max')
@@ -56,6 +145,158 @@ class Between(Aggregator):
 
         return self.min <= count <= self.max
 
+    def mask(self, counts, totals=None):
+        return (self.min <= counts) & (counts <= self.max)
+
+
+class AtLeast(Aggregator):
+    __slots__ = ('number',)
+
+    def __init__(self, number):
+        self.number = number
+
+    def __ror__(self, other):
+        if self.number <= 0:
+            return True
+
+        count = 0
+
+        for item in other:
+            count += 1
+
+            if self.number <= count:
+                return True
+
+        return False
+
+    def mask(self, counts, totals=None):
+        return counts >= self.number
+
+
+class AtMost(Aggregator):
+    __slots__ = ('number',)
+
+    def __init__(self, number):
+        self.number = number
+
+    def __ror__(self, other):
+        count = 0
+
+        for item in other:
+            count += 1
+
+            if self.number < count:
+                return False
+
+        return True
+
+    def mask(self, counts, totals=None):
+        return counts <= self.number
+
+
+class Ratio(Aggregator):
+    __slots__ = ('min', 'max')
+
+    def __init__(self, min, max=1.0):
+        self.min = min
+        self.max = max
+
+    def __ror__(self, other):
+        total = selection_total(other)
+
+        if total == 0:
+            return False
+
+        min_count = self.min * total
+        max_count = self.max * total
+
+        count = 0
+
+        for item in other:
+            count += 1
+
+            if max_count < count:
+                return False
+
+            if min_count <= count and total <= max_count:
+                return True
+
+        return min_count <= count <= max_count
+
+    def mask(self, counts, totals=None):
+        return (totals > 0) & (self.min * totals <= counts) & (counts <= self.max * totals)
+
+
+class Majority(Aggregator):
+    __slots__ = ()
+
+    def __ror__(self, other):
+        total = selection_total(other)
+
+        count = 0
+
+        for item in other:
+            count += 1
+
+            if total < 2 * count:
+                return True
+
+        return False
+
+    def mask(self, counts, totals=None):
+        return totals < 2 * counts
+
+
+class Sum(Aggregator):
+    __slots__ = ('weights', 'min', 'max')
+
+    def __init__(self, weights, min=None, max=None):
+        self.weights = weights
+        self.min = min
+        self.max = max
+
+    def weight(self, node):
+        return sum(weight for property, weight in self.weights.items() if property(node))
+
+    def __ror__(self, other):
+        # with non-negative weights sum can only grow
+        can_exceed = self.max is not None and all(0 <= weight for weight in self.weights.values())
+
+        total = 0
+
+        for node in other:
+            total += self.weight(node)
+
+            if can_exceed and self.max < total:
+                return False
+
+        return ((self.min is None or self.min <= total) and
+                (self.max is None or total <= self.max))
+
+    def values(self, nodes, filter):
+        values = numpy.zeros(len(nodes), dtype=numpy.result_type(0, *self.weights.values()))
+
+        for property, weight in self.weights.items():
+            values[property.mask(nodes)] += weight
+
+        values[~fuse(filter).mask(nodes)] = 0
+
+        return values
+
+    def values_key(self, filter):
+        return filter, tuple(self.weights.items())
+
+    def mask(self, counts, totals=None):
+        mask = numpy.ones(counts.shape, dtype=bool)
+
+        if self.min is not None:
+            mask &= self.min <= counts
+
+        if self.max is not None:
+            mask &= counts <= self.max
+
+        return mask
+
 
 class Exists(Aggregator):
     __slots__ = ()
@@ -65,3 +306,6 @@ class Exists(Aggregator):
             return True
 
         return False
+
+    def mask(self, counts, totals=None):
+        return counts > 0
@@ -0,0 +1,204 @@
+
+import os
+import collections
+
+import numpy
+
+from . import randomness
+from .files import atomic_save
+from .space import Space
+
+
+class Window:
+    __slots__ = ('space', 'origin', 'width', 'height', 'margin')
+
+    # regular space over rectangular part of lattice, margin nodes are read from neighbouring chunks
+    # to resolve areas near window border, but are never written back
+    def __init__(self, space, origin, width, height, margin):
+        self.space = space
+        self.origin = origin
+        self.width = width
+        self.height = height
+        self.margin = margin
+
+    def cell(self, index):
+        topology = self.space.topology
+        return topology.cell(index) + topology.lattice_cell(*self.origin)
+
+    def interior(self):
+        u, v = self.space.topology.lattice(numpy.arange(self.space.size()))
+
+        return ((self.margin <= u) & (u < self.margin + self.width) &
+                (self.margin <= v) & (v < self.margin + self.height))
+
+
+class ChunkedSpace:
+    __slots__ = ('topology_type', 'chunk_size', 'base_node', 'generator', 'random', 'budget', 'directory',
+                 'chunk_topology', 'generated', 'loaded', 'evictions', '_chunks', '_dirty', '_topologies')
+
+    # world of unlimited size, split into square chunks of lattice (see RectangleTopology and ParallelogramTopology);
+    # chunk is generated on first access by generator(space, origin), which gets regular space of single chunk;
+    # chunks are evicted when their total size exceeds budget (in bytes): saved to directory if it is set,
+    # otherwise unchanged chunks are dropped and generated again on next access
+    def __init__(self, topology_type, chunk_size, base_node, generator=None, seed=None, budget=None, directory=None):
+        self.topology_type = topology_type
+        self.chunk_size = chunk_size
+        self.base_node = base_node
+        self.generator = generator
+        self.random = randomness.Random(seed)
+        self.budget = budget
+        self.directory = directory
+
+        self.chunk_topology = topology_type(chunk_size, chunk_size)
+
+        self.generated = 0
+        self.loaded = 0
+        self.evictions = 0
+
+        self._chunks = collections.OrderedDict()
+        self._dirty = set()
+
+        # window topologies are reused, so are their connectomes
+        self._topologies = {}
+
+    def nbytes(self):
+        return sum(columns.nbytes for columns in self._chunks.values())
+
+    def stats(self):
+        return {'chunks': len(self._chunks),
+                'nbytes': self.nbytes(),
+                'generated': self.generated,
+                'loaded': self.loaded,
+                'evictions': self.evictions}
+
+    def chunk_path(self, key):
+        return os.path.join(self.directory, f'chunk_{key[0]}_{key[1]}.npy')
+
+    def is_saved(self, key):
+        return self.directory is not None and os.path.exists(self.chunk_path(key))
+
+    def chunk(self, key):
+        columns = self._chunks.get(key)
+
+        if columns is not None:
+            self._chunks.move_to_end(key)
+            return columns
+
+        if self.is_saved(key):
+            columns = numpy.load(self.chunk_path(key))
+            self.loaded += 1
+        else:
+            columns = self.generate(key)
+            self.generated += 1
+
+        self._chunks[key] = columns
+
+        self.shrink(keep=key)
+
+        return columns
+
+    def generate(self, key):
+        # every chunk has its own seed, so regenerated chunk is identical to dropped one
+        space = Space(self.chunk_topology, seed=self.random.key(*key))
+        space.initialize(self.base_node)
+
+        if self.generator is not None:
+            origin = self.chunk_topology.lattice_cell(key[0] * self.chunk_size, key[1] * self.chunk_size)
+            self.generator(space, origin)
+
+        return space.columns()
+
+    def save_chunk(self, key):
+        os.makedirs(self.directory, exist_ok=True)
+
+        atomic_save(self.chunk_path(key), self._chunks[key])
+
+        self._dirty.discard(key)
+
+    def flush(self):
+        if self.directory is None:
+            raise ValueError('chunks can be saved only with directory')
+
+        for key in list(self._dirty):
+            self.save_chunk(key)
+
+    def shrink(self, keep=None):
+        if self.budget is None:
+            return
+
+        nbytes = self.nbytes()
+
+        for key in list(self._chunks):
+            if nbytes <= self.budget:
+                break
+
+            if key == keep:
+                continue
+
+            if self.directory is not None:
+                if key in self._dirty or not self.is_saved(key):
+                    self.save_chunk(key)
+
+            elif key in self._dirty:
+                # changed chunk can not be dropped without place to save it
+                continue
+
+            nbytes -= self._chunks.pop(key).nbytes
+            self.evictions += 1
+
+    def window_topology(self, width, height):
+        topology = self._topologies.get((width, height))
+
+        if topology is None:
+            topology = self.topology_type(width, height)
+            self._topologies[(width, height)] = topology
+
+        return topology
+
+    def chunks_parts(self, topology, origin, indexes):
+        u, v = topology.lattice(indexes)
+
+        u = u + origin[0]
+        v = v + origin[1]
+
+        keys, inverse = numpy.unique(numpy.stack([u // self.chunk_size, v // self.chunk_size], axis=1),
+                                     axis=0,
+                                     return_inverse=True)
+
+        inverse = inverse.ravel()
+
+        for i, (chunk_u, chunk_v) in enumerate(keys.tolist()):
+            selected = inverse == i
+
+            chunk_indexes = self.chunk_topology.lattice_indexes(u[selected] - chunk_u * self.chunk_size,
+                                                                v[selected] - chunk_v * self.chunk_size)
+
+            yield (chunk_u, chunk_v), indexes[selected], chunk_indexes
+
+    def window(self, u, v, width, height, margin=0):
+        topology = self.window_topology(width + 2 * margin, height + 2 * margin)
+
+        origin = (u - margin, v - margin)
+
+        space = Space(topology, seed=randomness.mix(self.random.key(*origin)))
+        space.initialize(self.base_node)
+
+        columns = space.columns()
+
+        for key, indexes, chunk_indexes in self.chunks_parts(topology, origin, numpy.arange(topology.size())):
+            columns[:, indexes] = self.chunk(key)[:, chunk_indexes]
+
+        space.replace_columns(columns, columns.copy())
+
+        return Window(space, origin, width, height, margin)
+
+    def commit(self, window):
+        # base state of window is written, so it must be called after the last step of window
+        topology = window.space.topology
+        columns = window.space.columns()
+
+        indexes = numpy.flatnonzero(window.interior())
+
+        for key, window_indexes, chunk_indexes in self.chunks_parts(topology, window.origin, indexes):
+            self.chunk(key)[:, chunk_indexes] = columns[:, window_indexes]
+            self._dirty.add(key)
@@ -39,10 +39,10 @@ class RGBA(Color):
                 int(round(255 * self.a)))
 
     @classmethod
-    def random(cls, a=1.0):
-        return cls(r=random.random(),
-                   g=random.random(),
-                   b=random.random(),
+    def random(cls, a=1.0, generator=random):
+        return cls(r=generator.random(),
+                   g=generator.random(),
+                   b=generator.random(),
                    a=a)
 
 
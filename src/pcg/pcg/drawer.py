@@ -2,9 +2,15 @@
 import typing
 import dataclasses
 
+import numpy
+
 from PIL import Image
 
+from . import nodes
 from . import colors
+from . import writers
+from .filters import filter_mask
+from .topologies import Connectome
 
 
 @dataclasses.dataclass
@@ -15,14 +21,18 @@ class Biome:
 
 
 class Drawer:
-    __slots__ = ('biomes', 'duration', 'frames', 'filename')
+    __slots__ = ('biomes', 'duration', 'filename', 'writer')
 
-    def __init__(self, duration, filename):
+    def __init__(self, duration, filename, writer=None):
         self.biomes = []
         self.duration = duration
-        self.frames = []
         self.filename = filename
 
+        if writer is None:
+            writer = writers.Animation(filename=filename, duration=duration)
+
+        self.writer = writer
+
     def node_position(self, node, canvas_size):
         raise NotImplementedError()
 
@@ -41,6 +51,21 @@ class Drawer:
             if biome.checker(node):
                 return biome
 
+    def biomes_indexes(self, nodes):
+        # nodes without biome get index of background color
+        indexes = numpy.full(len(nodes), len(self.biomes), dtype=numpy.int32)
+
+        # first suitable biome wins, so later biomes are painted first
+        for i in reversed(range(len(self.biomes))):
+            indexes[filter_mask(self.biomes[i].checker, nodes)] = i
+
+        return indexes
+
+    def colors_table(self):
+        table = [biome.sprite.color.ints for biome in self.biomes]
+        table.append(colors.BLACK.ints)
+        return numpy.array(table, dtype=numpy.uint8)
+
     def draw(self, nodes):
         canvas_size = self.calculate_canvas_size(nodes)
 
@@ -60,14 +85,87 @@ class Drawer:
 
         return canvas
 
+    def render(self, space):
+        return self.draw(list(space.base()))
+
     def record(self, space):
-        canvas = self.draw(list(space.base()))
-        self.frames.append(canvas)
+        self.writer.write(self.render(space))
 
     def finish(self):
-        self.frames[0].save(self.filename,
-                            lossles=True,
-                            quality=100,
-                            duration=self.duration,
-                            save_all=True,
-                            append_images=self.frames[1:])
+        self.writer.close()
+
+
+class RasterDrawer(Drawer):
+    __slots__ = ('delta', '_raster', '_canvas')
+
+    # frames are gathered from cached pixel -> node index map;
+    # in delta mode only nodes changed by the last step are repainted over the previous frame
+    def __init__(self, delta=False, **kwargs):
+        super().__init__(**kwargs)
+        self.delta = delta
+        self._raster = None
+        self._canvas = None
+
+    def build_lookup(self, topology):
+        raise NotImplementedError()
+
+    def lookup(self, topology):
+        if self._raster is None or self._raster[0] is not topology:
+            self._raster = (topology, self.build_lookup(topology), None)
+            self._canvas = None
+
+        return self._raster[1]
+
+    def cells_pixels(self, topology):
+        self.lookup(topology)
+
+        topology, lookup, pixels = self._raster
+
+        if pixels is None:
+            # pixels grouped by node in the same way as neighbours in connectome
+            counts = numpy.bincount(lookup.ravel(), minlength=topology.size() + 1)
+
+            offsets = numpy.zeros(topology.size() + 1, dtype=numpy.int64)
+            numpy.cumsum(counts[:-1], out=offsets[1:])
+
+            pixels = Connectome(offsets=offsets,
+                                indices=numpy.argsort(lookup, axis=None, kind='stable'))
+
+            self._raster = (topology, lookup, pixels)
+
+        return pixels
+
+    def can_repaint(self, space):
+        return (self.delta and
+                self._canvas is not None and
+                self._canvas[0] is space and
+                self._canvas[1] + 1 == space.steps)
+
+    def paint(self, space, table):
+        indexes = numpy.append(self.biomes_indexes(nodes.Batch(space)), len(self.biomes))
+        return table[indexes[self.lookup(space.topology)]]
+
+    def render(self, space):
+        table = self.colors_table()
+
+        if self.can_repaint(space):
+            canvas = self._canvas[2]
+
+            changed = space.changed()
+
+            pixels = self.cells_pixels(space.topology)
+            lengths = pixels.offsets[changed + 1] - pixels.offsets[changed]
+
+            colors = table[self.biomes_indexes(nodes.Batch(space, changed))]
+
+            canvas.reshape(-1, 4)[pixels.neighbours(changed)] = numpy.repeat(colors, lengths, axis=0)
+        else:
+            canvas = self.paint(space, table)
+
+        if not self.delta:
+            return Image.fromarray(canvas, 'RGBA')
+
+        self._canvas = (space, space.steps, canvas)
+
+        # canvas is changed by next frames, so image must own its pixels
+        return Image.fromarray(canvas.copy(), 'RGBA')
@@ -0,0 +1,29 @@
+
+import os
+import json
+import tempfile
+
+import numpy
+
+
+def atomic_write(path, write, mode='wb'):
+    # other processes and memory mapped readers must never see partially written file,
+    # so it is written next to its place and moved there in one step
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+
+    try:
+        with os.fdopen(descriptor, mode) as file:
+            write(file)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+    os.replace(temporary_path, path)
+
+
+def atomic_save(path, data):
+    atomic_write(path, lambda file: numpy.save(file, data))
+
+
+def atomic_save_json(path, data):
+    atomic_write(path, lambda file: json.dump(data, file), mode='w')
@@ -1,5 +1,10 @@
 
-import random
+import re
+import sys
+import hashlib
+import functools
+
+import numpy
 
 
 class Filter:
@@ -8,6 +13,26 @@ class Filter:
     def __invert__(self):
         return Inverter(self)
 
+    def mask(self, nodes):
+        return numpy.fromiter((self(node) for node in nodes), dtype=bool, count=len(nodes))
+
+    def expression(self, name):
+        return f'{name}(node)'
+
+
+def filter_mask(filter, nodes):
+    if hasattr(filter, 'mask'):
+        return filter.mask(nodes)
+
+    return Filter.mask(filter, nodes)
+
+
+def filter_expression(filter, name):
+    if hasattr(filter, 'expression'):
+        return filter.expression(name)
+
+    return Filter.expression(filter, name)
+
 
 class Inverter(Filter):
     __slots__ = ('base',)
@@ -18,6 +43,12 @@ class Inverter(Filter):
     def __call__(self, node):
         return not self.base(node)
 
+    def mask(self, nodes):
+        return ~filter_mask(self.base, nodes)
+
+    def expression(self, name):
+        return f'not ({filter_expression(self.base, name + ".base")})'
+
 
 class All(Filter):
     __slots__ = ()
@@ -25,12 +56,108 @@ class All(Filter):
     def __call__(self, node):
         return True
 
+    def mask(self, nodes):
+        return numpy.ones(len(nodes), dtype=bool)
+
+    def expression(self, name):
+        return 'True'
+
+
+def call_site_stream(depth):
+    # place in code does not depend on history of process, so fraction created there gets the same stream
+    # in every run and every worker
+    frame = sys._getframe(depth + 1)
+    site = (frame.f_globals.get('__name__'), frame.f_code.co_name, frame.f_lineno, frame.f_lasti)
+    return int.from_bytes(hashlib.sha1(repr(site).encode()).digest()[:8], 'little')
+
 
 class Fraction(Filter):
-    __slots__ = ('fraction',)
+    __slots__ = ('fraction', 'stream')
 
-    def __init__(self, fraction):
+    # by default stream is derived from place in code, where fraction is created, so fractions created
+    # in different places are independent; fractions created in the same place (like in a loop or helper
+    # function) share stream and must get explicit different streams, if they are checked during the same step
+    def __init__(self, fraction, stream=None):
         self.fraction = fraction
+        self.stream = call_site_stream(1) if stream is None else stream
 
     def __call__(self, node):
-        return (random.random() < self.fraction)
+        space = node.space
+        return space.random.uniform(space.steps, node.index, self.stream) < self.fraction
+
+    def mask(self, nodes):
+        space = nodes.space
+        return space.random.uniforms(space.steps, nodes.node_indexes(), self.stream) < self.fraction
+
+
+class Chain(Filter):
+    __slots__ = ('filters', 'predicate', 'filter_indexes')
+
+    def __init__(self, filters):
+        self.filters = filters
+        self.predicate, self.filter_indexes = self.compile()
+
+    def compile(self):
+        namespace = {f'filter_{i}': filter for i, filter in enumerate(self.filters)}
+
+        conditions = [filter_expression(filter, name) for name, filter in namespace.items()]
+
+        condition = " and ".join(conditions) or "True"
+
+        # node views are created only for filters, which can not be expressed through node values
+        node_source = '        node = Node(space, index, is_new)\n' if re.search(r'\bnode\b', condition) else ''
+
+        source = ('def predicate(node):\n'
+                  '    values = node.space.values(node.index, node.is_new)\n'
+                  f'    return {condition}\n'
+                  '\n'
+                  'def filter_indexes(space, indexes, is_new, Node):\n'
+                  '    cache = space.values_cache(is_new)\n'
+                  '    node_values = space.values\n'
+                  '    passed = []\n'
+                  '    for index in indexes:\n'
+                  '        values = cache.get(index)\n'
+                  '        if values is None:\n'
+                  '            values = node_values(index, is_new)\n'
+                  f'{node_source}'
+                  f'        if {condition}:\n'
+                  '            passed.append(index)\n'
+                  '    return passed\n')
+
+        exec(source, namespace)
+
+        return namespace['predicate'], namespace['filter_indexes']
+
+    def __call__(self, node):
+        return self.predicate(node)
+
+    def positions(self, nodes):
+        positions = numpy.arange(len(nodes))
+
+        # every next filter is checked only for nodes accepted by previous ones
+        for filter in self.filters:
+            positions = positions[filter_mask(filter, nodes.subset(positions))]
+
+        return positions
+
+    def select(self, nodes):
+        return nodes.subset(self.positions(nodes))
+
+    def mask(self, nodes):
+        mask = numpy.zeros(len(nodes), dtype=bool)
+        mask[self.positions(nodes)] = True
+        return mask
+
+
+# small cache is enough for filters of hot loops and does not keep many stale filters alive
+@functools.lru_cache(maxsize=128)
+def cached_chain(*filters):
+    return Chain(filters)
+
+
+def fuse(*filters):
+    try:
+        return cached_chain(*filters)
+    except TypeError:
+        # unhashable filters are fused on every call
+        return Chain(filters)
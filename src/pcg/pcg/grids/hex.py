@@ -1,12 +1,14 @@
 import math
 import dataclasses
 
+import numpy
+
 from PIL import Image
 from PIL import ImageDraw
 
 from pcg import colors
 from pcg import drawer
-from pcg.topologies import BaseArea
+from pcg.topologies import BaseArea, ArrayTopology
 from pcg.geometry import Point, BoundingBox
 
 
@@ -188,6 +190,125 @@ def cells_hexagon(radius):
             yield Cell.from_qr(q, r)
 
 
+class HexagonTopology(ArrayTopology):
+    __slots__ = ('radius', '_rows_starts')
+
+    # same nodes order as cells_hexagon: rows by q, cells of row by r
+    def __init__(self, radius):
+        super().__init__()
+        self.radius = radius
+
+        rows_sizes = 2 * radius + 1 - numpy.abs(numpy.arange(-radius, radius + 1))
+
+        self._rows_starts = numpy.zeros(2 * radius + 2, dtype=numpy.int64)
+        numpy.cumsum(rows_sizes, out=self._rows_starts[1:])
+
+    def parameters(self):
+        return self.radius,
+
+    def size(self):
+        return int(self._rows_starts[-1])
+
+    def coordinates(self):
+        return list(cells_hexagon(self.radius))
+
+    def row_min_r(self, q):
+        return numpy.maximum(-self.radius, -q - self.radius)
+
+    def qr(self, indexes):
+        q = numpy.searchsorted(self._rows_starts, indexes, side='right') - 1 - self.radius
+        r = indexes - self._rows_starts[q + self.radius] + self.row_min_r(q)
+        return q, r
+
+    def cell(self, index):
+        q, r = self.qr(index)
+        return Cell.from_qr(int(q), int(r))
+
+    def index(self, cell):
+        if max(abs(cell.q), abs(cell.r), abs(cell.s)) > self.radius:
+            return None
+
+        return int(self._rows_starts[cell.q + self.radius] + cell.r - self.row_min_r(cell.q))
+
+    def offset(self, cell):
+        return cell.q, cell.r
+
+    def shift(self, indexes, offset):
+        q, r = self.qr(indexes)
+
+        q = q + offset[0]
+        r = r + offset[1]
+
+        inside = numpy.maximum(numpy.maximum(numpy.abs(q), numpy.abs(r)), numpy.abs(q + r)) <= self.radius
+
+        q = numpy.clip(q, -self.radius, self.radius)
+
+        return numpy.where(inside, self._rows_starts[q + self.radius] + r - self.row_min_r(q), -1)
+
+
+class ParallelogramTopology(ArrayTopology):
+    __slots__ = ('q', 'r', 'wrap')
+
+    # same nodes order as cells_parallelogram(q=q, r=r), wrapped parallelogram is hex torus
+    def __init__(self, q, r, wrap=False):
+        super().__init__()
+        self.q = q
+        self.r = r
+        self.wrap = wrap
+
+    def parameters(self):
+        return self.q, self.r, self.wrap
+
+    def size(self):
+        return self.q * self.r
+
+    def coordinates(self):
+        return list(cells_parallelogram(q=self.q, r=self.r))
+
+    def cell(self, index):
+        return Cell.from_qr(index // self.r, index % self.r)
+
+    # lattice coordinates are used to split grid into chunks, for parallelogram they are q and r
+    @staticmethod
+    def lattice_cell(u, v):
+        return Cell.from_qr(u, v)
+
+    def lattice(self, indexes):
+        return indexes // self.r, indexes % self.r
+
+    def lattice_indexes(self, u, v):
+        return u * self.r + v
+
+    def index(self, cell):
+        q, r = cell.q, cell.r
+
+        if self.wrap:
+            q %= self.q
+            r %= self.r
+
+        if 0 <= q < self.q and 0 <= r < self.r:
+            return q * self.r + r
+
+        return None
+
+    def offset(self, cell):
+        if self.wrap:
+            return cell.q % self.q, cell.r % self.r
+
+        return cell.q, cell.r
+
+    def shift(self, indexes, offset):
+        q = indexes // self.r + offset[0]
+        r = indexes % self.r + offset[1]
+
+        if self.wrap:
+            return (q % self.q) * self.r + r % self.r
+
+        inside = (0 <= q) & (q < self.q) & (0 <= r) & (r < self.r)
+
+        return numpy.where(inside, q * self.r + r, -1)
+
+
 # https://www.redblobgames.com/grids/hexagons/implementation.html#shape-rectangle
 def cells_rectangle():
     raise NotImplementedError
@@ -239,25 +360,15 @@ def area_template(min_distance, max_distance, distance):
     return area
 
 
-def area(topology, distance, min_distance, max_distance):
-    cache = [None] * topology.size()
-
-    template = area_template(min_distance, max_distance, distance)
-
-    for center, index in topology.indexes.items():
-        points = [center + point for point in template]
-        cache[index] = topology.area_indexes(points)
-
-    return cache
-
-
 class Euclidean(BaseArea):
     __slots__ = ()
 
-    def connectome(self, topology, min_distance, max_distance):
-        return area(topology, self.distance, min_distance, max_distance)
+    @classmethod
+    def template(cls, min_distance, max_distance):
+        return area_template(min_distance, max_distance, cls.distance)
 
-    def distance(self, a, b=Cell(0, 0, 0)):
+    @staticmethod
+    def distance(a, b=Cell(0, 0, 0)):
         a = cell_center(a)
         b = cell_center(b)
         return math.sqrt((a.x-b.x)**2 + (a.y-b.y)**2)
@@ -266,20 +377,24 @@ class Euclidean(BaseArea):
 class Manhattan(BaseArea):
     __slots__ = ()
 
-    def connectome(self, topology, min_distance, max_distance):
-        return area(topology, self.distance, min_distance, max_distance)
+    @classmethod
+    def template(cls, min_distance, max_distance):
+        return area_template(min_distance, max_distance, cls.distance)
 
-    def distance(self, a, b=Cell(0, 0, 0)):
+    @staticmethod
+    def distance(a, b=Cell(0, 0, 0)):
         return manhattan_distance(a, b)
 
 
 class Ring(BaseArea):
     __slots__ = ()
 
-    def connectome(self, topology, min_distance, max_distance):
-        return area(topology, self.distance, min_distance, max_distance)
+    @classmethod
+    def template(cls, min_distance, max_distance):
+        return area_template(min_distance, max_distance, cls.distance)
 
-    def distance(self, a, b=Cell(0, 0, 0)):
+    @staticmethod
+    def distance(a, b=Cell(0, 0, 0)):
         return max(abs(a.q-b.q), abs(a.r-b.r))
 
 
@@ -307,7 +422,7 @@ class Sprite:
                       fill=self.color.ints)
 
 
-class Drawer(drawer.Drawer):
+class Drawer(drawer.RasterDrawer):
     __slots__ = ('cell_size',)
 
     def __init__(self, cell_size, **kwargs):
@@ -317,9 +432,30 @@ class Drawer(drawer.Drawer):
     def prepair_sprite(self, sprite):
         sprite.prepair(self.cell_size)
 
+    def cell_position(self, cell, canvas_size):
+        return canvas_size / 2 + cell_center(cell) * self.cell_size - self.cell_size
+
     def node_position(self, node, canvas_size):
-        return canvas_size / 2 + cell_center(node.coordinates) * self.cell_size - self.cell_size
+        return self.cell_position(node.coordinates, canvas_size)
 
     def calculate_canvas_size(self, nodes):
         coordinates = [node.coordinates for node in nodes]
         return (cells_bounding_box(coordinates).size * self.cell_size).round_up()
+
+    def build_lookup(self, topology):
+        cells = topology.coordinates()
+
+        canvas_size = (cells_bounding_box(cells).size * self.cell_size).round_up()
+
+        sprite = Sprite()
+        sprite.prepair(self.cell_size)
+        mask = sprite.image.getchannel('A')
+
+        # pixels outside of cells point to background index
+        lookup = Image.new('I', canvas_size.xy, len(cells))
+
+        for index, cell in enumerate(cells):
+            position = self.cell_position(cell, canvas_size).xy
+            lookup.paste(index, (int(position[0]), int(position[1])), mask)
+
+        return numpy.asarray(lookup)
@@ -1,11 +1,14 @@
 import math
 import dataclasses
 
+import numpy
+
 from PIL import Image
 
+from pcg import nodes
 from pcg import colors
 from pcg import drawer
-from pcg.topologies import BaseArea
+from pcg.topologies import BaseArea, ArrayTopology
 from pcg.geometry import Point, BoundingBox
 
 
@@ -35,6 +38,79 @@ def cells_rectangle(width, height):
             yield Cell(x, y)
 
 
+def cells_xy(cells):
+    x = numpy.fromiter((cell.x for cell in cells), dtype=numpy.int64, count=len(cells))
+    y = numpy.fromiter((cell.y for cell in cells), dtype=numpy.int64, count=len(cells))
+    return x, y
+
+
+class RectangleTopology(ArrayTopology):
+    __slots__ = ('width', 'height', 'wrap')
+
+    # same nodes order as cells_rectangle, wrapped rectangle is torus: edges are connected to opposite ones
+    def __init__(self, width, height, wrap=False):
+        super().__init__()
+        self.width = width
+        self.height = height
+        self.wrap = wrap
+
+    def parameters(self):
+        return self.width, self.height, self.wrap
+
+    def size(self):
+        return self.width * self.height
+
+    def coordinates(self):
+        return list(cells_rectangle(self.width, self.height))
+
+    def xy(self):
+        indexes = numpy.arange(self.size())
+        return indexes % self.width, indexes // self.width
+
+    def cell(self, index):
+        return Cell(index % self.width, index // self.width)
+
+    # lattice coordinates are used to split grid into chunks, for rectangle they are x and y
+    @staticmethod
+    def lattice_cell(u, v):
+        return Cell(u, v)
+
+    def lattice(self, indexes):
+        return indexes % self.width, indexes // self.width
+
+    def lattice_indexes(self, u, v):
+        return v * self.width + u
+
+    def index(self, cell):
+        x, y = cell.x, cell.y
+
+        if self.wrap:
+            x %= self.width
+            y %= self.height
+
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return y * self.width + x
+
+        return None
+
+    def offset(self, cell):
+        if self.wrap:
+            return cell.x % self.width, cell.y % self.height
+
+        return cell.x, cell.y
+
+    def shift(self, indexes, offset):
+        x = indexes % self.width + offset[0]
+        y = indexes // self.width + offset[1]
+
+        if self.wrap:
+            return (y % self.height) * self.width + x % self.width
+
+        inside = (0 <= x) & (x < self.width) & (0 <= y) & (y < self.height)
+
+        return numpy.where(inside, y * self.width + x, -1)
+
+
 def cell_center(cell):
     return Point(cell.x + 0.5, cell.y + 0.5)
 
@@ -69,45 +145,39 @@ def area_template(min_distance, max_distance, distance):
     return area
 
 
-def area(topology, distance, min_distance, max_distance):
-    cache = [None] * topology.size()
-
-    template = area_template(min_distance, max_distance, distance)
-
-    for center, index in topology.indexes.items():
-        points = [center + point for point in template]
-        cache[index] = topology.area_indexes(points)
-
-    return cache
-
-
 class Euclidean(BaseArea):
     __slots__ = ()
 
-    def connectome(self, topology, min_distance, max_distance):
-        return area(topology, self.distance, min_distance, max_distance)
+    @classmethod
+    def template(cls, min_distance, max_distance):
+        return area_template(min_distance, max_distance, cls.distance)
 
-    def distance(self, a, b=Cell(0, 0)):
+    @staticmethod
+    def distance(a, b=Cell(0, 0)):
         return math.sqrt((a.x-b.x)**2 + (a.y-b.y)**2)
 
 
 class Manhattan(BaseArea):
     __slots__ = ()
 
-    def connectome(self, topology, min_distance, max_distance):
-        return area(topology, self.distance, min_distance, max_distance)
+    @classmethod
+    def template(cls, min_distance, max_distance):
+        return area_template(min_distance, max_distance, cls.distance)
 
-    def distance(self, a, b=Cell(0, 0)):
+    @staticmethod
+    def distance(a, b=Cell(0, 0)):
         return abs(a.x-b.x) + abs(a.y-b.y)
 
 
 class Ring(BaseArea):
     __slots__ = ()
 
-    def connectome(self, topology, min_distance, max_distance):
-        return area(topology, self.distance, min_distance, max_distance)
+    @classmethod
+    def template(cls, min_distance, max_distance):
+        return area_template(min_distance, max_distance, cls.distance)
 
-    def distance(self, a, b=Cell(0, 0)):
+    @staticmethod
+    def distance(a, b=Cell(0, 0)):
         return max(abs(a.x-b.x), abs(a.y-b.y))
 
 
@@ -124,12 +194,13 @@ class Sprite:
         self.image = Image.new('RGBA', cell_size.xy, self.color.ints)
 
 
-class Drawer(drawer.Drawer):
-    __slots__ = ('cell_size',)
+class Drawer(drawer.RasterDrawer):
+    __slots__ = ('cell_size', '_grid')
 
     def __init__(self, cell_size, **kwargs):
         super().__init__(**kwargs)
         self.cell_size = cell_size
+        self._grid = None
 
     def prepair_sprite(self, sprite):
         sprite.prepair(self.cell_size)
@@ -140,3 +211,36 @@ class Drawer(drawer.Drawer):
     def calculate_canvas_size(self, nodes):
         coordinates = [node.coordinates for node in nodes]
         return (cells_bounding_box(coordinates).size * self.cell_size).round_up()
+
+    def grid(self, topology):
+        if self._grid is None or self._grid[0] is not topology:
+            if isinstance(topology, RectangleTopology):
+                x, y = topology.xy()
+            else:
+                x, y = cells_xy(topology.coordinates())
+            x -= x.min()
+            y -= y.min()
+            self._grid = (topology, x, y, (int(y.max()) + 1, int(x.max()) + 1))
+
+        return self._grid[1:]
+
+    def upscale(self, grid):
+        width, height = self.cell_size.xy
+        return grid.repeat(int(height), axis=0).repeat(int(width), axis=1)
+
+    def build_lookup(self, topology):
+        x, y, shape = self.grid(topology)
+
+        grid = numpy.full(shape, topology.size(), dtype=numpy.int32)
+        grid[y, x] = numpy.arange(topology.size())
+
+        return self.upscale(grid)
+
+    def paint(self, space, table):
+        x, y, shape = self.grid(space.topology)
+
+        grid = numpy.full(shape, len(self.biomes), dtype=numpy.int32)
+        grid[y, x] = self.biomes_indexes(nodes.Batch(space))
+
+        # biomes are mapped to colors before upscaling, it is cheaper than gathering by lookup
+        return self.upscale(table[grid])
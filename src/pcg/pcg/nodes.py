@@ -1,75 +1,109 @@
 
 
+import numpy
+
 from .filters import Inverter
 
 
 class Property:
-    __slots__ = ('index',)
+    __slots__ = ('index', 'value')
 
-    def __init__(self, index):
+    def __init__(self, index, value):
         self.index = index
+        self.value = value
 
     def apply_to(self, node):
-        node.properties[self.index] = self
+        node.set(self.index, self.value)
 
     def __call__(self, node):
-        return node.properties[self.index] is self
+        return node.get(self.index) == self.value
+
+    def mask(self, nodes):
+        return nodes.get(self.index) == self.value
+
+    def expression(self, name):
+        return f'values[{self.index}] == {self.value}'
 
     def __invert__(self):
         return Inverter(self)
 
 
 class Fabric:
-    __slots__ = ('property_groups',)
+    __slots__ = ('property_groups', 'properties')
 
     def __init__(self):
         self.property_groups = {}
+        self.properties = []
 
     def properties_size(self):
         return len(self.property_groups)
 
+    def layout(self):
+        # groups in order of their indexes with number of properties in every group
+        return [[str(group), len(self.properties[index])] for group, index in self.property_groups.items()]
+
     def Property(self, group):
         index = self.property_groups.get(group)
 
         if index is None:
             index = self.properties_size()
             self.property_groups[group] = index
+            self.properties.append([])
 
-        return Property(index)
+        # value 0 is reserved for nodes without property from that group
+        property = Property(index, len(self.properties[index]) + 1)
+
+        self.properties[index].append(property)
+
+        return property
 
     def Node(self, *properties):
-        node = Node(properties=[None] * self.properties_size())
+        node = Prototype(fabric=self, values=[0] * self.properties_size())
         for property in properties:
             property.apply_to(node)
         return node
 
 
+class Prototype:
+    __slots__ = ('fabric', 'values')
+
+    def __init__(self, fabric, values):
+        self.fabric = fabric
+        self.values = values
+
+    def get(self, group):
+        return self.values[group]
+
+    def set(self, group, value):
+        self.values[group] = value
+
+
 class Node:
-    __slots__ = ('index', 'coordinates', 'space', 'properties', '_new_node')
-
-    def __init__(self, properties):
-        self.index = None
-        self.coordinates = None
-        self._new_node = None
-        self.space = None
-        self.properties = properties
-
-    def clone(self):
-        clone = Node(properties=list(self.properties))
-        clone.index = self.index
-        clone.coordinates = self.coordinates
-        clone.space = self.space
-        clone._new_node = None
-        return clone
+    __slots__ = ('space', 'index', 'is_new')
+
+    def __init__(self, space, index, is_new=False):
+        self.space = space
+        self.index = index
+        self.is_new = is_new
+
+    @property
+    def coordinates(self):
+        return self.space.topology.cell(self.index)
+
+    def get(self, group):
+        return self.space.values(self.index, self.is_new)[group]
+
+    def set(self, group, value):
+        self.space.register_new_node(self.index)
+        self.space.columns(new=True)[group, self.index] = value
 
     def new_node(self):
-        if self._new_node is not None:
-            return self._new_node
+        if self.is_new:
+            return self
 
-        self._new_node = self.clone()
-        self.space.register_new_node(self._new_node)
+        self.space.register_new_node(self.index)
 
-        return self._new_node
+        return Node(self.space, self.index, is_new=True)
 
     def __ilshift__(self, other):
         new_node = self.new_node()
@@ -79,3 +113,42 @@ class Node:
                 property.apply_to(new_node)
         else:
             other.apply_to(new_node)
+
+
+class Batch:
+    __slots__ = ('space', 'indexes', 'is_new')
+
+    def __init__(self, space, indexes=None, is_new=False):
+        self.space = space
+        self.indexes = indexes
+        self.is_new = is_new
+
+    def __len__(self):
+        if self.indexes is None:
+            return self.space.size()
+
+        return len(self.indexes)
+
+    def __iter__(self):
+        for index in self.node_indexes().tolist():
+            yield Node(self.space, index, is_new=self.is_new)
+
+    def node_indexes(self):
+        if self.indexes is None:
+            return numpy.arange(self.space.size())
+
+        return numpy.asarray(self.indexes)
+
+    def subset(self, positions):
+        if self.indexes is None:
+            return Batch(self.space, positions, is_new=self.is_new)
+
+        return Batch(self.space, numpy.asarray(self.indexes)[positions], is_new=self.is_new)
+
+    def get(self, group):
+        column = self.space.columns(self.is_new)[group]
+
+        if self.indexes is None:
+            return column
+
+        return column[self.indexes]
@@ -0,0 +1,135 @@
+
+import os
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy
+
+
+# task of the current run, inherited by forked workers instead of pickling the space
+_TASK = None
+
+
+def _run_tile(task):
+    space, rule, columns = _TASK
+
+    bounds, base, steps = task
+
+    # workers live through several steps, so they follow buffers swaps and steps of parent space
+    if space.columns() is not columns[base]:
+        space.replace_columns(columns[base], columns[1 - base])
+
+    space.steps = steps
+
+    rule(space, numpy.arange(*bounds))
+
+    return space.collect_changes()
+
+
+class Executor:
+    __slots__ = ('space', 'processes', 'tiles', '_blocks', '_columns', '_pool', '_rule')
+
+    # rules receive (space, indexes), must read base state and write only nodes from their indexes;
+    # workers are forked, so platforms without fork start method are not supported;
+    # pool of workers is reused by all runs of the same rule, so executor should be kept for all steps
+    def __init__(self, space, processes=None, tiles=None):
+        self.space = space
+        self.processes = processes or os.cpu_count()
+        self.tiles = tiles or self.processes * 4
+        self._blocks = []
+        self._columns = []
+        self._pool = None
+        self._rule = None
+
+    def __enter__(self):
+        self.share()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def share(self):
+        if self._blocks:
+            return
+
+        columns = []
+
+        for column in (self.space.columns(), self.space.columns(new=True)):
+            block = shared_memory.SharedMemory(create=True, size=max(1, column.nbytes))
+
+            shared_column = numpy.ndarray(column.shape, dtype=column.dtype, buffer=block.buf)
+            shared_column[...] = column
+
+            self._blocks.append(block)
+            columns.append(shared_column)
+
+        self.space.replace_columns(*columns)
+
+        self._columns = columns
+
+    def close_pool(self):
+        if self._pool is None:
+            return
+
+        self._pool.close()
+        self._pool.join()
+
+        self._pool = None
+        self._rule = None
+
+    def close(self):
+        self.close_pool()
+
+        if not self._blocks:
+            return
+
+        self.space.replace_columns(self.space.columns().copy(),
+                                   self.space.columns(new=True).copy())
+
+        for block in self._blocks:
+            block.unlink()
+
+            try:
+                block.close()
+            except BufferError:
+                # somebody still holds a view of shared columns, memory is released with it
+                pass
+
+        self._blocks = []
+        self._columns = []
+
+    def tiles_bounds(self):
+        bounds = numpy.linspace(0, self.space.size(), self.tiles + 1).astype(int).tolist()
+        return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if start < stop]
+
+    def pool(self, rule):
+        global _TASK
+
+        if self._pool is not None and self._rule == rule:
+            return self._pool
+
+        self.close_pool()
+
+        # workers inherit rule and shared columns when they are forked
+        _TASK = (self.space, rule, self._columns)
+
+        try:
+            self._pool = multiprocessing.get_context('fork').Pool(self.processes)
+        finally:
+            _TASK = None
+
+        self._rule = rule
+
+        return self._pool
+
+    def run(self, rule):
+        self.share()
+
+        pool = self.pool(rule)
+
+        base = 0 if self.space.columns() is self._columns[0] else 1
+
+        tasks = [(bounds, base, self.space.steps) for bounds in self.tiles_bounds()]
+
+        for changes in pool.imap_unordered(_run_tile, tasks):
+            self.space.assign(changes)
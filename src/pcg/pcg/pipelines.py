@@ -0,0 +1,265 @@
+
+import os
+import contextlib
+import collections
+import multiprocessing
+
+import numpy
+
+from . import nodes
+from .filters import All, Chain, Fraction, Inverter
+from .parallel import Executor
+from .aggregators import Exists
+
+
+VECTORIZED = 'vectorized'
+FRONTIER = 'frontier'
+PARALLEL = 'parallel'
+
+# frontier is used only while it is small part of space
+FRONTIER_RATIO = 0.25
+
+# areas of selected nodes are checked one by one only while they are small part of nodes
+SUBSET_RATIO = 0.25
+
+PARALLEL_THRESHOLD = 2**20
+
+
+def unique_indexes(indexes):
+    # sorting is several times faster than hash based numpy.unique for integer indexes
+    indexes = numpy.sort(indexes)
+
+    if indexes.size == 0:
+        return indexes
+
+    return indexes[numpy.concatenate(([True], indexes[1:] != indexes[:-1]))]
+
+
+def is_random(filter):
+    if isinstance(filter, Fraction):
+        return True
+
+    if isinstance(filter, Inverter):
+        return is_random(filter.base)
+
+    if isinstance(filter, Chain):
+        return any(is_random(subfilter) for subfilter in filter.filters)
+
+    return False
+
+
+class Rule:
+    __slots__ = ('selectors', 'area', 'min_distance', 'max_distance', 'filter', 'aggregator', 'results')
+
+    # nodes passing selectors get results if aggregator accepts nodes passing filter in their area;
+    # rule reads only base state, like space.base() | aggregator does
+    def __init__(self, results, selectors=(), area=None, filter=All(), aggregator=None,
+                 min_distance=1, max_distance=None):
+        self.results = results if isinstance(results, (tuple, list)) else (results,)
+        self.selectors = tuple(selectors)
+        self.area = area
+        self.min_distance = min_distance
+        self.max_distance = min_distance if max_distance is None else max_distance
+        self.filter = filter
+        self.aggregator = Exists() if aggregator is None and area is not None else aggregator
+
+    def neighbourhood(self):
+        if self.area is None:
+            return None
+
+        return self.area, self.min_distance, self.max_distance
+
+    def is_random(self):
+        return any(is_random(filter) for filter in self.selectors + (self.filter,))
+
+    def counting_key(self):
+        return self.neighbourhood(), self.filter
+
+    def mask(self, space, indexes, connectomes):
+        selected = space.mask(*self.selectors, indexes=indexes)
+
+        if self.area is None:
+            return selected
+
+        connectome = connectomes.get(space, self.neighbourhood())
+
+        positions = numpy.flatnonzero(selected)
+
+        all_nodes = nodes.Batch(space)
+
+        # counts for all nodes are computed once and used by every rule with the same area and filter
+        if indexes is None and (positions.size > SUBSET_RATIO * selected.size or connectomes.is_shared(self)):
+            selected &= self.aggregator.bulk(connectome, all_nodes, self.filter)
+            return selected
+
+        subset = positions if indexes is None else indexes[positions]
+
+        selected[positions] = self.aggregator.bulk(connectome, all_nodes, self.filter, indexes=subset)
+
+        return selected
+
+    def apply(self, space, indexes, connectomes):
+        selected = self.mask(space, indexes, connectomes)
+
+        space.assign(selected if indexes is None else indexes[selected], *self.results)
+
+
+class SharedConnectome:
+    __slots__ = ('connectome', '_counts')
+
+    # counts of the same values in the same areas are computed once for all rules of step
+    def __init__(self, connectome):
+        self.connectome = connectome
+        self._counts = {}
+
+    def degrees(self, indexes=None):
+        return self.connectome.degrees(indexes)
+
+    def shared_counts(self, aggregator, nodes, filter, indexes=None):
+        key = (aggregator.values_key(filter), None if indexes is None else indexes.tobytes())
+
+        counts = self._counts.get(key)
+
+        if counts is None:
+            counts = aggregator.counts(self.connectome, nodes, filter, indexes)
+            self._counts[key] = counts
+
+        return counts
+
+
+class SharedConnectomes:
+    __slots__ = ('_connectomes', '_uses')
+
+    def __init__(self, rules):
+        self._connectomes = {}
+        self._uses = collections.Counter(rule.counting_key() for rule in rules if rule.area is not None)
+
+    def is_shared(self, rule):
+        return self._uses[rule.counting_key()] > 1
+
+    def get(self, space, neighbourhood):
+        connectome = self._connectomes.get(neighbourhood)
+
+        if connectome is None:
+            area, min_distance, max_distance = neighbourhood
+            connectome = SharedConnectome(area.get_connectome(space.topology, min_distance, max_distance))
+            self._connectomes[neighbourhood] = connectome
+
+        return connectome
+
+
+def apply_rules(rules, space, indexes=None):
+    connectomes = SharedConnectomes(rules)
+
+    # all rules read base state, so order of rules matters only for nodes changed by several of them
+    for rule in rules:
+        rule.apply(space, indexes, connectomes)
+
+
+class Stage:
+    __slots__ = ('rules', 'repeat')
+
+    # rules of stage are applied together during one step, repeat times
+    def __init__(self, rules, repeat=1):
+        self.rules = rules
+        self.repeat = repeat
+
+    def is_random(self):
+        return any(rule.is_random() for rule in self.rules)
+
+    def neighbourhoods(self):
+        return {rule.neighbourhood() for rule in self.rules}
+
+    def apply_tile(self, space, tile):
+        apply_rules(self.rules, space, tile)
+
+
+class Pipeline:
+    __slots__ = ('space', 'stages', 'processes', 'engines')
+
+    def __init__(self, space, processes=None):
+        self.space = space
+        self.stages = []
+        self.processes = processes or os.cpu_count()
+
+        # engine used for every executed step
+        self.engines = []
+
+    def add(self, *rules, repeat=1):
+        self.stages.append(Stage(rules, repeat=repeat))
+        return self
+
+    def prepare(self):
+        for stage in self.stages:
+            for neighbourhood in stage.neighbourhoods():
+                if neighbourhood is None:
+                    continue
+
+                area, min_distance, max_distance = neighbourhood
+                area.get_connectome(self.space.topology, min_distance, max_distance)
+
+    def frontier(self, stage):
+        changed = self.space.changed()
+
+        parts = [changed]
+
+        for neighbourhood in stage.neighbourhoods():
+            if neighbourhood is None:
+                continue
+
+            area, min_distance, max_distance = neighbourhood
+            connectome = area.get_connectome(self.space.topology, min_distance, max_distance)
+
+            parts.append(connectome.neighbours(changed))
+
+        # cost depends only on number of changed nodes, not on size of space
+        return unique_indexes(numpy.concatenate(parts))
+
+    def can_run_parallel(self):
+        return (self.processes > 1 and
+                self.space.size() >= PARALLEL_THRESHOLD and
+                'fork' in multiprocessing.get_all_start_methods())
+
+    def plan(self, stage, iteration):
+        # nodes outside frontier and their areas did not change since previous application of the same
+        # deterministic rules, so these rules would not change them again
+        changed = self.space.changed()
+
+        if iteration > 0 and not stage.is_random() and changed.size <= FRONTIER_RATIO * self.space.size():
+            frontier = self.frontier(stage)
+
+            if frontier.size <= FRONTIER_RATIO * self.space.size():
+                return FRONTIER, frontier
+
+        if self.can_run_parallel():
+            return PARALLEL, None
+
+        return VECTORIZED, None
+
+    def run_step(self, stage, iteration, executor):
+        engine, indexes = self.plan(stage, iteration)
+
+        self.engines.append(engine)
+
+        with self.space.step():
+            if engine == PARALLEL:
+                executor.run(stage.apply_tile)
+            else:
+                apply_rules(stage.rules, self.space, indexes)
+
+    def run_stage(self, stage):
+        # the same workers and shared columns are used by all steps of stage
+        if self.can_run_parallel():
+            context = Executor(self.space, processes=self.processes)
+        else:
+            context = contextlib.nullcontext()
+
+        with context as executor:
+            for iteration in range(stage.repeat):
+                self.run_step(stage, iteration, executor)
+
+    def run(self):
+        self.prepare()
+
+        for stage in self.stages:
+            self.run_stage(stage)
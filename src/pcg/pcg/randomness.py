@@ -0,0 +1,55 @@
+
+import random
+
+import numpy
+
+
+MASK = 0xFFFFFFFFFFFFFFFF
+
+GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+MIX_1 = 0xBF58476D1CE4E5B9
+MIX_2 = 0x94D049BB133111EB
+
+
+# splitmix64 finalizer: scalar and vectorized versions must give identical results
+def mix(value):
+    value = (value + GOLDEN_GAMMA) & MASK
+    value = ((value ^ (value >> 30)) * MIX_1) & MASK
+    value = ((value ^ (value >> 27)) * MIX_2) & MASK
+    return value ^ (value >> 31)
+
+
+def mix_array(values):
+    values = values + numpy.uint64(GOLDEN_GAMMA)
+    values = (values ^ (values >> numpy.uint64(30))) * numpy.uint64(MIX_1)
+    values = (values ^ (values >> numpy.uint64(27))) * numpy.uint64(MIX_2)
+    return values ^ (values >> numpy.uint64(31))
+
+
+def to_float(value):
+    return (value >> 11) * 2.0**-53
+
+
+class Random:
+    __slots__ = ('seed',)
+
+    # counter-based generator: every value depends only on (seed, step, stream, node index),
+    # so results do not depend on iteration order or on splitting work between processes
+    def __init__(self, seed=None):
+        if seed is None:
+            seed = random.getrandbits(64)
+
+        self.seed = seed & MASK
+
+    def key(self, step, stream=0):
+        return mix(mix(mix(self.seed) ^ (step & MASK)) ^ (stream & MASK))
+
+    def uniform(self, step, index, stream=0):
+        return to_float(mix(self.key(step, stream) ^ index))
+
+    def uniforms(self, step, indexes, stream=0):
+        values = numpy.asarray(indexes).astype(numpy.uint64) ^ numpy.uint64(self.key(step, stream))
+        return (mix_array(values) >> numpy.uint64(11)).astype(numpy.float64) * 2.0**-53
+
+    def generator(self, step, stream=0):
+        return random.Random(self.key(step, stream))
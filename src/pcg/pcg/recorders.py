@@ -0,0 +1,91 @@
+
+import time
+
+
+class Policy:
+    __slots__ = ('recorder', 'space')
+
+    # decides whether wrapped recorder is called, skipped steps cost no recorder work
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.space = None
+
+    def should_record(self, space):
+        raise NotImplementedError('must be overriden in child classes')
+
+    def record(self, space):
+        self.space = space
+
+        if self.should_record(space):
+            self.recorder.record(space)
+
+    def finish(self):
+        if hasattr(self.recorder, 'finish'):
+            self.recorder.finish()
+
+
+class EveryNSteps(Policy):
+    __slots__ = ('steps',)
+
+    def __init__(self, recorder, steps):
+        super().__init__(recorder)
+        self.steps = steps
+
+    def should_record(self, space):
+        return space.steps % self.steps == 0
+
+
+class TimeInterval(Policy):
+    __slots__ = ('seconds', '_last_time')
+
+    def __init__(self, recorder, seconds):
+        super().__init__(recorder)
+        self.seconds = seconds
+        self._last_time = None
+
+    def should_record(self, space):
+        now = time.monotonic()
+
+        if self._last_time is not None and now - self._last_time < self.seconds:
+            return False
+
+        self._last_time = now
+
+        return True
+
+
+class ChangeRatio(Policy):
+    __slots__ = ('threshold', '_changes')
+
+    # changes are accumulated since last recorded state, node changed twice is counted twice
+    def __init__(self, recorder, threshold):
+        super().__init__(recorder)
+        self.threshold = threshold
+        self._changes = None
+
+    def should_record(self, space):
+        if self._changes is None:
+            self._changes = 0
+            return True
+
+        self._changes += len(space.changed())
+
+        if self._changes < self.threshold * space.size():
+            return False
+
+        self._changes = 0
+
+        return True
+
+
+class FinalOnly(Policy):
+    __slots__ = ()
+
+    def should_record(self, space):
+        return False
+
+    def finish(self):
+        if self.space is not None:
+            self.recorder.record(self.space)
+
+        super().finish()
@@ -1,83 +1,415 @@
 
+import os
+import json
+import tempfile
 import contextlib
 
+import numpy
+
+from . import nodes
+from . import randomness
+from .files import atomic_save, atomic_save_json
+from .filters import fuse
+
+
+# columns use the smallest type able to hold values of every property group
+COLUMN_TYPES = (numpy.uint8, numpy.uint16, numpy.uint32)
+INDEX_TYPE = numpy.int64
+
+# smaller selections are filtered node by node, bigger ones with masks
+VECTORIZATION_THRESHOLD = 64
+
+SNAPSHOT_VERSION = 1
+
+
+def column_type(fabric):
+    max_value = max((len(properties) for properties in fabric.properties), default=0)
+
+    for candidate in COLUMN_TYPES:
+        if max_value <= numpy.iinfo(candidate).max:
+            return candidate
+
+    raise ValueError(f'too many properties in group: {max_value}')
+
+
+def python_indexes(indexes):
+    if isinstance(indexes, numpy.ndarray):
+        return indexes.tolist()
+
+    return indexes
+
+
+class Changes:
+    __slots__ = ('mask', '_indexes', '_chunks')
+
+    def __init__(self, size):
+        self.mask = numpy.zeros(size, dtype=bool)
+        # single indexes registered by nodes and arrays registered by bulk operations
+        self._indexes = []
+        self._chunks = []
+
+    def __len__(self):
+        return len(self._indexes) + sum(chunk.size for chunk in self._chunks)
+
+    def __contains__(self, index):
+        return self.mask[index]
+
+    def add(self, index):
+        if self.mask[index]:
+            return
+
+        self.mask[index] = True
+        self._indexes.append(index)
+
+    def update(self, indexes):
+        indexes = indexes[~self.mask[indexes]]
+
+        # indexes taken from masks are already sorted and unique
+        if indexes.size > 1 and not (indexes[1:] > indexes[:-1]).all():
+            indexes = numpy.unique(indexes)
+
+        self.mask[indexes] = True
+        self._chunks.append(indexes)
+
+    def indexes(self):
+        if not self._indexes and len(self._chunks) == 1:
+            return self._chunks[0]
+
+        indexes = numpy.concatenate([numpy.array(self._indexes, dtype=INDEX_TYPE)] + self._chunks)
+        indexes.sort()
+
+        self._indexes = []
+        self._chunks = [indexes]
+
+        return indexes
+
+    def clear(self):
+        indexes = self.indexes()
+
+        self.mask[indexes] = False
+
+        self._indexes = []
+        self._chunks = []
+
+        return indexes
+
+
+class Snapshot:
+    __slots__ = ('path', 'owned', 'file', 'shape', 'dtype', 'order', 'offset')
+
+    # file with base columns shared copy-on-write by forked spaces; file is kept open, so forks get state
+    # of the snapshot even after its path is replaced by newer save; owned temporary file is removed
+    # when no space uses it anymore, already mapped columns stay valid after that
+    def __init__(self, path, owned=False):
+        self.path = path
+        self.owned = owned
+
+        self.file = open(path, 'rb')
+
+        version = numpy.lib.format.read_magic(self.file)
+
+        if version == (1, 0):
+            self.shape, fortran_order, self.dtype = numpy.lib.format.read_array_header_1_0(self.file)
+        else:
+            self.shape, fortran_order, self.dtype = numpy.lib.format.read_array_header_2_0(self.file)
+
+        self.order = 'F' if fortran_order else 'C'
+        self.offset = self.file.tell()
+
+    @classmethod
+    def create(cls, columns):
+        descriptor, path = tempfile.mkstemp(suffix='.npy')
+
+        with os.fdopen(descriptor, 'wb') as file:
+            numpy.save(file, columns)
+
+        return cls(path, owned=True)
+
+    def columns(self):
+        return numpy.memmap(self.file, dtype=self.dtype, mode='c', offset=self.offset, shape=self.shape,
+                            order=self.order)
+
+    def __del__(self):
+        self.file.close()
+
+        if not self.owned:
+            return
+
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
 
 class Space:
-    __slots__ = ('_base_nodes', '_new_nodes', 'topology', 'recorders')
+    __slots__ = ('_base', '_new', '_base_values', '_changes', '_last_changes', '_snapshot', 'fabric', 'topology',
+                 'recorders', 'random', 'steps')
 
-    def __init__(self, topology, recorders=()):
-        self._base_nodes = []
-        self._new_nodes = []
+    def __init__(self, topology, recorders=(), seed=None):
+        # property columns: row per property group, column per node
+        self._base = numpy.zeros((0, 0), dtype=COLUMN_TYPES[0])
+        self._new = numpy.zeros((0, 0), dtype=COLUMN_TYPES[0])
+
+        # values of nodes read one by one from base state during current step
+        self._base_values = {}
+
+        self._changes = Changes(0)
+        self._last_changes = numpy.zeros(0, dtype=INDEX_TYPE)
+
+        # file with current base state, if it was already written
+        self._snapshot = None
+
+        self.fabric = None
 
         self.topology = topology
 
         self.recorders = recorders
 
+        self.random = randomness.Random(seed)
+        self.steps = 0
+
     def size(self):
-        return len(self._base_nodes)
+        return self._base.shape[1]
+
+    def nbytes(self):
+        # memory used for nodes, connectomes are accounted by topology
+        return self._base.nbytes + self._new.nbytes + self._changes.mask.nbytes
 
     def initialize(self, base_node):
-        base_node.space = self
+        self.fabric = base_node.fabric
+
+        # properties must be created before initialization, so values of all of them fit into columns
+        values = numpy.array(base_node.values, dtype=column_type(self.fabric))
 
-        self._base_nodes = [None] * self.topology.size()
-        self._new_nodes = [None] * self.topology.size()
+        self._base = numpy.repeat(values[:, None], self.topology.size(), axis=1)
+        self._new = self._base.copy()
 
-        for i, coordinates in enumerate(self.topology.coordinates()):
-            node = base_node.clone()
-            node.coordinates = coordinates
-            node.index = i
+        self.reset_values()
 
-            self._base_nodes[i] = node
+        self._changes = Changes(self.topology.size())
+        self._last_changes = numpy.arange(self.topology.size(), dtype=INDEX_TYPE)
 
-            self.topology.register_index(coordinates, i)
+        self._snapshot = None
 
         self.record_state()
 
-    def register_new_node(self, node):
-        self._new_nodes[node.index] = node
+    def columns(self, new=False):
+        return self._new if new else self._base
+
+    def values(self, index, new=False):
+        # base state does not change during step, so values of nodes read one by one are kept as python lists,
+        # which are much faster to compare than numpy scalars; only nodes actually read are cached
+        if new:
+            return self._new[:, index].tolist()
+
+        values = self._base_values.get(index)
+
+        if values is None:
+            values = self._base[:, index].tolist()
+            self._base_values[index] = values
+
+        return values
+
+    def values_cache(self, new=False):
+        # new state changes during step, so its values are never cached
+        return {} if new else self._base_values
+
+    def reset_values(self):
+        self._base_values = {}
+
+    def replace_columns(self, base, new):
+        if base.shape != self._base.shape or new.shape != self._new.shape:
+            raise ValueError('columns shape must not change')
+
+        self._base = base
+        self._new = new
+
+        self.reset_values()
+
+        self._snapshot = None
+
+    def changed(self):
+        return self._last_changes
+
+    def register_new_node(self, index):
+        self._changes.add(index)
+
+    def collect_changes(self):
+        # stop tracking pending changes and return their indexes, values stay in new buffer
+        return self._changes.clear()
+
+    def assign(self, indexes, *properties):
+        indexes = numpy.asarray(indexes)
+
+        if indexes.dtype == bool:
+            indexes = numpy.flatnonzero(indexes)
+        else:
+            indexes = indexes.astype(INDEX_TYPE, copy=False)
+
+        self._changes.update(indexes)
+
+        for property in properties:
+            self._new[property.index, indexes] = property.value
+
+    def mask(self, *filters, indexes=None):
+        return fuse(*filters).mask(nodes.Batch(self, indexes=indexes))
+
+    def count_neighbours(self, area, filter, min_distance=1, max_distance=None):
+        connectome = area.get_connectome(self.topology, min_distance, max_distance)
+        return connectome.count(fuse(filter).mask(nodes.Batch(self)))
+
+    def aggregate(self, area, filter, aggregator, min_distance=1, max_distance=None):
+        connectome = area.get_connectome(self.topology, min_distance, max_distance)
+        return aggregator.bulk(connectome, nodes.Batch(self), filter)
+
+    def frontier(self, area, min_distance=1, max_distance=None):
+        connectome = area.get_connectome(self.topology, min_distance, max_distance)
+
+        # changed nodes are always part of frontier, independent of area's min distance
+        return numpy.union1d(self._last_changes, connectome.neighbours(self._last_changes))
+
+    def _restrict(self, indexes, frontier):
+        if frontier is None:
+            return indexes
+
+        # frontier is area or (area, min_distance, max_distance), like neighbourhoods of rules
+        if not isinstance(frontier, tuple):
+            frontier = (frontier,)
+
+        frontier = self.frontier(*frontier)
 
-    def base(self, *filters, indexes=None):
         if indexes is None:
-            indexes = range(self.size())
+            return frontier.tolist()
 
-        for i in indexes:
-            node = self._base_nodes[i]
+        return numpy.intersect1d(indexes, frontier).tolist()
 
-            for filter in filters:
-                if not filter(node):
-                    break
-            else:
-                yield node
+    def base(self, *filters, indexes=None, frontier=None):
+        if frontier is not None:
+            indexes = self._restrict(indexes, frontier)
+
+        chain = fuse(*filters)
+
+        # base state does not change during iteration, so all filters can be checked in advance
+        if indexes is None or len(indexes) >= VECTORIZATION_THRESHOLD:
+            return iter(chain.select(nodes.Batch(self, indexes=indexes)))
+
+        passed = chain.filter_indexes(self, python_indexes(indexes), False, nodes.Node)
+
+        return iter([nodes.Node(self, i) for i in passed])
 
     def new(self, *filters, indexes=None):
         if indexes is None:
-            indexes = range(self.size())
+            indexes = self._changes.indexes().tolist()
 
-        for i in indexes:
-            node = self._new_nodes[i]
+        predicate = fuse(*filters).predicate
 
-            if node is None:
+        for i in python_indexes(indexes):
+            if i not in self._changes:
                 continue
 
-            for filter in filters:
-                if not filter(node):
-                    break
-            else:
+            node = nodes.Node(self, i, is_new=True)
+
+            if predicate(node):
                 yield node
 
-    def actual(self, *filters, indexes=None):
+    def actual(self, *filters, indexes=None, frontier=None):
+        indexes = self._restrict(indexes, frontier)
+
         if indexes is None:
             indexes = range(self.size())
 
-        for i in indexes:
-            node = self._new_nodes[i] or self._base_nodes[i]
+        predicate = fuse(*filters).predicate
+
+        for i in python_indexes(indexes):
+            node = nodes.Node(self, i, is_new=i in self._changes)
 
-            for filter in filters:
-                if not filter(node):
-                    break
-            else:
+            if predicate(node):
                 yield node
 
+    def save(self, path):
+        if len(self._changes):
+            raise ValueError('space with uncommitted changes can not be saved')
+
+        os.makedirs(path, exist_ok=True)
+
+        # random generator is counter-based, so seed and steps fully describe its state
+        meta = {'version': SNAPSHOT_VERSION,
+                'topology': self.topology.fingerprint(),
+                'fabric': self.fabric.layout(),
+                'steps': self.steps,
+                'seed': self.random.seed}
+
+        # space loaded from the same snapshot memory maps its files, so they are never overwritten in place
+        atomic_save(os.path.join(path, 'columns.npy'), self._base)
+        atomic_save(os.path.join(path, 'last_changes.npy'), self._last_changes)
+        atomic_save_json(os.path.join(path, 'meta.json'), meta)
+
+    @classmethod
+    def load(cls, path, topology, fabric, recorders=()):
+        with open(os.path.join(path, 'meta.json')) as file:
+            meta = json.load(file)
+
+        if meta['version'] != SNAPSHOT_VERSION:
+            raise ValueError(f'unsupported snapshot version {meta["version"]}')
+
+        if meta['topology'] != topology.fingerprint():
+            raise ValueError('snapshot was made for other topology')
+
+        if meta['fabric'] != fabric.layout():
+            raise ValueError('snapshot was made for other fabric')
+
+        space = cls(topology, recorders=recorders, seed=meta['seed'])
+
+        space.fabric = fabric
+
+        # both buffers are private copy-on-write mappings of the same file, pages are copied only when changed
+        columns_path = os.path.join(path, 'columns.npy')
+
+        space._snapshot = Snapshot(columns_path)
+
+        space._base = space._snapshot.columns()
+        space._new = space._snapshot.columns()
+        space.reset_values()
+
+        space._changes = Changes(topology.size())
+        space._last_changes = numpy.load(os.path.join(path, 'last_changes.npy'))
+
+        space.steps = meta['steps']
+
+        return space
+
+    def fork(self, seed=None, recorders=()):
+        if len(self._changes):
+            raise ValueError('space with uncommitted changes can not be forked')
+
+        # snapshot is written once and reused by all forks made before base changes
+        if self._snapshot is None:
+            self._snapshot = Snapshot.create(self._base)
+
+            # parent switches to shared pages too, so memory of all forks grows only with their divergence
+            self._base = self._snapshot.columns()
+            self._new = self._snapshot.columns()
+            self.reset_values()
+
+        space = Space(self.topology,
+                      recorders=recorders,
+                      seed=self.random.seed if seed is None else seed)
+
+        space.fabric = self.fabric
+
+        space._snapshot = self._snapshot
+
+        space._base = self._snapshot.columns()
+        space._new = self._snapshot.columns()
+        space.reset_values()
+
+        space._changes = Changes(self.size())
+        space._last_changes = self._last_changes.copy()
+
+        space.steps = self.steps
+
+        return space
+
     def record_state(self):
         for recorder in self.recorders:
             recorder.record(self)
@@ -87,10 +419,19 @@ class Space:
 
         yield
 
-        for i, node in enumerate(self._new_nodes):
-            if node is not None:
-                self._base_nodes[i] = node
-                self._new_nodes[i] = None
+        changed = self._changes.clear()
+
+        # new buffer becomes base, old base is synchronized only in changed nodes
+        self._base, self._new = self._new, self._base
+        self._new[:, changed] = self._base[:, changed]
+
+        self.reset_values()
+
+        self._last_changes = changed
+
+        if changed.size:
+            self._snapshot = None
 
+        self.steps += 1
 
         self.record_state()
@@ -1,20 +1,35 @@
+import os
+import array
+import hashlib
+import collections
+
+import numpy
+
+from .files import atomic_save
 
 
 class Topology:
-    __slots__ = ('connectomes', 'indexes')
+    __slots__ = ('connectomes', 'indexes', 'cells')
 
     def __init__(self, coordinates):
-        self.connectomes = {}
-        self.indexes = {xy: None for xy in coordinates}
+        self.connectomes = ConnectomesCache()
+        self.cells = list(dict.fromkeys(coordinates))
+        self.indexes = {xy: i for i, xy in enumerate(self.cells)}
 
     def size(self):
-        return len(self.indexes)
+        return len(self.cells)
 
     def coordinates(self):
-        return self.indexes.keys()
+        return self.cells
+
+    def cell(self, index):
+        return self.cells[index]
+
+    def index(self, coordinates):
+        return self.indexes.get(coordinates)
 
-    def register_index(self, coordinates, index):
-        self.indexes[coordinates] = index
+    def fingerprint(self):
+        return hashlib.sha1(repr(self.cells).encode()).hexdigest()
 
     def area_indexes(self, coordinates):
         area = []
@@ -29,34 +44,567 @@ class Topology:
 
         return tuple(area)
 
+    def node_neighbours(self, index, template):
+        center = self.cell(index)
+        return numpy.array(self.area_indexes([center + point for point in template]), dtype=numpy.int32)
+
+    def connectome(self, template):
+        offsets = numpy.zeros(self.size() + 1, dtype=numpy.int64)
+        indices = array.array('i')
+
+        for index, center in enumerate(self.cells):
+            indices.extend(self.area_indexes([center + point for point in template]))
+            offsets[index + 1] = len(indices)
+
+        return Connectome(offsets=offsets,
+                          indices=numpy.frombuffer(indices, dtype=numpy.int32))
+
+
+class ArrayTopology(Topology):
+    __slots__ = ()
+
+    # topology of regular grid: indexes are computed arithmetically and connectomes are built
+    # by shifting arrays of indexes, child classes define coordinates math
+    CHUNK_SIZE = 2**18
+
+    def __init__(self):
+        self.connectomes = ConnectomesCache()
+        self.indexes = None
+        self.cells = None
+
+    def size(self):
+        raise NotImplementedError('must be overriden in child classes')
+
+    def coordinates(self):
+        return [self.cell(index) for index in range(self.size())]
+
+    def cell(self, index):
+        raise NotImplementedError('must be overriden in child classes')
+
+    def index(self, coordinates):
+        raise NotImplementedError('must be overriden in child classes')
+
+    def parameters(self):
+        raise NotImplementedError('must be overriden in child classes')
+
+    def fingerprint(self):
+        topology_type = type(self)
+        description = (topology_type.__module__, topology_type.__name__, self.parameters())
+        return hashlib.sha1(repr(description).encode()).hexdigest()
+
+    def area_indexes(self, coordinates):
+        area = []
+
+        for point in coordinates:
+            index = self.index(point)
+
+            if index is None:
+                continue
+
+            area.append(index)
+
+        return tuple(area)
+
+    def offset(self, cell):
+        raise NotImplementedError('must be overriden in child classes')
+
+    def shift(self, indexes, offset):
+        raise NotImplementedError('must be overriden in child classes')
+
+    def connectome(self, template):
+        shifts = [self.offset(cell) for cell in template]
+
+        # in wrapped topologies different offsets can lead to the same neighbour
+        if len(set(shifts)) != len(shifts):
+            raise ValueError('area does not fit into topology')
+
+        size = self.size()
+
+        offsets = numpy.zeros(size + 1, dtype=numpy.int64)
+        indices = []
+
+        # nodes are processed by chunks to limit memory of temporary (nodes, template) matrix
+        for start in range(0, size, self.CHUNK_SIZE):
+            indexes = numpy.arange(start, min(size, start + self.CHUNK_SIZE))
+
+            neighbours = numpy.empty((indexes.size, len(shifts)), dtype=numpy.int32)
+
+            for i, offset in enumerate(shifts):
+                neighbours[:, i] = self.shift(indexes, offset)
+
+            exists = neighbours >= 0
+
+            indices.append(neighbours[exists])
+            offsets[indexes + 1] = exists.sum(axis=1)
+
+        numpy.cumsum(offsets, out=offsets)
+
+        return Connectome(offsets=offsets,
+                          indices=numpy.concatenate(indices) if indices else numpy.zeros(0, dtype=numpy.int32))
+
+
+def lengths_offsets(lengths):
+    offsets = numpy.zeros(len(lengths) + 1, dtype=numpy.int64)
+    numpy.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def segments_sums(values, offsets):
+    totals = numpy.zeros(values.size + 1, dtype=numpy.result_type(values, numpy.int64))
+    numpy.cumsum(values, out=totals[1:])
+    return totals[offsets[1:]] - totals[offsets[:-1]]
+
+
+class Connectome:
+    __slots__ = ('offsets', 'indices')
+
+    # compressed sparse row: neighbours of node i are indices[offsets[i]:offsets[i+1]]
+    def __init__(self, offsets, indices):
+        self.offsets = offsets
+        self.indices = indices
+
+    def size(self):
+        return self.offsets.size - 1
+
+    def degrees(self, indexes=None):
+        if indexes is None:
+            return numpy.diff(self.offsets)
+
+        return self.offsets[indexes + 1] - self.offsets[indexes]
+
+    def nbytes(self):
+        return self.offsets.nbytes + self.indices.nbytes
+
+    def arrays(self):
+        return {'indices': self.indices, 'offsets': self.offsets}
+
+    def __getitem__(self, index):
+        return self.indices[self.offsets[index]:self.offsets[index + 1]]
+
+    def neighbours(self, indexes):
+        starts = self.offsets[indexes]
+        lengths = self.offsets[indexes + 1] - starts
+
+        # positions of every neighbour of every requested node inside indices array
+        shifts = numpy.repeat(starts - numpy.cumsum(lengths) + lengths, lengths)
+
+        return self.indices[shifts + numpy.arange(shifts.size)]
+
+    def count(self, values, indexes=None):
+        if indexes is None:
+            return segments_sums(values[self.indices], self.offsets)
+
+        return segments_sums(values[self.neighbours(indexes)], lengths_offsets(self.degrees(indexes)))
+
+    def is_uniform(self):
+        degrees = self.degrees()
+        return degrees.size == 0 or (degrees == degrees[0]).all()
+
+    def dense(self):
+        size = self.size()
+        degrees = self.degrees()
+
+        if self.is_uniform():
+            width = int(degrees[0]) if size else 0
+            return DenseConnectome(self.indices.reshape(size, width), degrees=degrees)
+
+        # missing neighbours point to void node, which is placed right after the last node
+        matrix = numpy.full((size, int(degrees.max())), size, dtype=numpy.int32)
+
+        columns = numpy.arange(self.indices.size) - numpy.repeat(self.offsets[:-1], degrees)
+        matrix[numpy.repeat(numpy.arange(size), degrees), columns] = self.indices
+
+        return DenseConnectome(matrix, degrees=degrees)
+
+
+class DenseConnectome:
+    __slots__ = ('matrix', '_degrees')
+
+    # row of neighbours per node, padded with index of void node (equal to size) for nodes with fewer neighbours
+    def __init__(self, matrix, degrees=None):
+        self.matrix = matrix
+
+        if degrees is None:
+            degrees = (matrix != matrix.shape[0]).sum(axis=1)
+
+        self._degrees = degrees
+
+    def size(self):
+        return self.matrix.shape[0]
+
+    def width(self):
+        return self.matrix.shape[1]
+
+    def is_padded(self):
+        return self._degrees.size > 0 and self._degrees.min() < self.width()
+
+    def degrees(self, indexes=None):
+        if indexes is None:
+            return self._degrees
+
+        return self._degrees[indexes]
+
+    def nbytes(self):
+        return self.matrix.nbytes + self._degrees.nbytes
+
+    def arrays(self):
+        return {'matrix': self.matrix, 'degrees': self._degrees}
+
+    def __getitem__(self, index):
+        neighbours = self.matrix[index]
+
+        if self._degrees[index] < self.width():
+            return neighbours[neighbours != self.size()]
+
+        return neighbours
+
+    def neighbours(self, indexes):
+        neighbours = self.matrix[indexes].ravel()
+
+        if self.is_padded():
+            return neighbours[neighbours != self.size()]
+
+        return neighbours
+
+    def count(self, values, indexes=None):
+        if self.is_padded():
+            # void node never passes filter and has zero weight
+            values = numpy.append(values, numpy.zeros(1, dtype=values.dtype))
+
+        matrix = self.matrix if indexes is None else self.matrix[indexes]
+
+        return values[matrix].sum(axis=1, dtype=numpy.result_type(values, numpy.int64))
+
+
+class LazyConnectome:
+    __slots__ = ('topology', 'template', 'keep', '_rows', '_rows_nbytes', '_full')
+
+    # neighbours are found only for requested nodes, full connectome is built only for bulk operations;
+    # without keep nothing is remembered between calls
+    def __init__(self, topology, template, keep=True):
+        self.topology = topology
+        self.template = template
+        self.keep = keep
+
+        self._rows = {}
+        self._rows_nbytes = 0
+        self._full = None
+
+    def size(self):
+        return self.topology.size()
+
+    def nbytes(self):
+        if self._full is not None:
+            return self._full.nbytes()
+
+        return self._rows_nbytes
+
+    def full(self):
+        if self._full is not None:
+            return self._full
+
+        connectome = compact(self.topology.connectome(self.template))
+
+        if self.keep:
+            self._full = connectome
+            self._rows = {}
+            self._rows_nbytes = 0
+
+        return connectome
+
+    def dense(self):
+        connectome = self.full()
+
+        if isinstance(connectome, DenseConnectome):
+            return connectome
+
+        return connectome.dense()
+
+    def degrees(self, indexes=None):
+        if self._full is None and indexes is not None:
+            return numpy.array([len(self[index]) for index in numpy.asarray(indexes).tolist()], dtype=numpy.int64)
+
+        return self.full().degrees(indexes)
+
+    def __getitem__(self, index):
+        if self._full is not None:
+            return self._full[index]
+
+        row = self._rows.get(index)
+
+        if row is None:
+            row = self.topology.node_neighbours(index, self.template)
+
+            if self.keep:
+                self._rows[index] = row
+                self._rows_nbytes += row.nbytes
+
+        return row
+
+    def neighbours(self, indexes):
+        if self._full is not None:
+            return self._full.neighbours(indexes)
+
+        rows = [self[index] for index in numpy.asarray(indexes).tolist()]
+
+        if not rows:
+            return numpy.zeros(0, dtype=numpy.int32)
+
+        return numpy.concatenate(rows)
+
+    def count(self, values, indexes=None):
+        if self._full is None and indexes is not None:
+            return segments_sums(values[self.neighbours(indexes)], lengths_offsets(self.degrees(indexes)))
+
+        return self.full().count(values, indexes)
+
+
+def compact(connectome):
+    # areas of the same size for every node are stored as matrix without padding
+    if connectome.is_uniform():
+        return connectome.dense()
+
+    return connectome
+
+
+# connectome policies: build whole connectome on first request, build neighbours of requested nodes only,
+# or build on every request without caching
+EAGER = 'eager'
+LAZY = 'lazy'
+TRANSIENT = 'transient'
+
+
+class ConnectomesCache:
+    __slots__ = ('budget', 'default_policy', 'policies', 'directory', 'hits', 'misses', 'evictions',
+                 '_connectomes')
+
+    # least recently used connectomes are evicted when their total size exceeds budget (in bytes),
+    # with directory eager connectomes are also stored on disk and shared between processes via memory mapping
+    def __init__(self, budget=None, default_policy=EAGER, directory=None):
+        self.budget = budget
+        self.default_policy = default_policy
+        self.policies = {}
+        self.directory = directory
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._connectomes = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._connectomes)
+
+    def __contains__(self, uid):
+        return uid in self._connectomes
+
+    def __getitem__(self, uid):
+        return self._connectomes[uid]
+
+    def __setitem__(self, uid, connectome):
+        self._connectomes[uid] = connectome
+        self._connectomes.move_to_end(uid)
+        self.shrink(keep=uid)
+
+    def policy(self, uid):
+        return self.policies.get(uid[:3], self.default_policy)
+
+    def set_policy(self, area, policy, min_distance=1, max_distance=None):
+        if max_distance is None:
+            max_distance = min_distance
+
+        uid = (area.__name__, min_distance, max_distance)
+
+        self.policies[uid] = policy
+
+        # connectomes built with previous policy are dropped
+        for cached_uid in list(self._connectomes):
+            if cached_uid[:3] == uid:
+                del self._connectomes[cached_uid]
+
+    def get(self, uid):
+        connectome = self._connectomes.get(uid)
+
+        if connectome is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        # order of connectomes matters only for eviction, lazy connectomes grow between requests
+        if self.budget is not None:
+            self._connectomes.move_to_end(uid)
+            self.shrink(keep=uid)
+
+        return connectome
+
+    def nbytes(self):
+        return sum(connectome.nbytes() for connectome in self._connectomes.values())
+
+    def shrink(self, keep=None):
+        if self.budget is None:
+            return
+
+        nbytes = self.nbytes()
+
+        for uid in list(self._connectomes):
+            if nbytes <= self.budget:
+                break
+
+            if uid == keep:
+                continue
+
+            nbytes -= self._connectomes.pop(uid).nbytes()
+            self.evictions += 1
+
+    def clear(self):
+        self._connectomes.clear()
+
+    def disk_key(self, topology, area, uid, min_distance, max_distance):
+        if self.directory is None:
+            return None
+
+        # name of area class is not enough: areas from different modules may share it, and templates may change
+        description = (topology.fingerprint(),
+                       area.__module__,
+                       area.__qualname__,
+                       uid,
+                       list(area.template(min_distance, max_distance)))
+
+        return hashlib.sha1(repr(description).encode()).hexdigest()
+
+    def path(self, key, name):
+        return os.path.join(self.directory, f'{key}.{name}.npy')
+
+    def load(self, key):
+        if key is None:
+            return None
+
+        # arrays are written in order, so presence of the last one means that connectome is complete
+        for connectome_type, names in DISK_LAYOUTS:
+            if os.path.exists(self.path(key, names[-1])):
+                return connectome_type(**{name: numpy.load(self.path(key, name), mmap_mode='r') for name in names})
+
+        return None
+
+    def store(self, key, connectome):
+        if key is None:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        for name, data in connectome.arrays().items():
+            atomic_save(self.path(key, name), data)
+
+    def stats(self):
+        return {'connectomes': len(self._connectomes),
+                'nbytes': self.nbytes(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+
+# names of arrays stored on disk for every connectome type, in order of writing
+DISK_LAYOUTS = ((DenseConnectome, ('matrix', 'degrees')),
+                (Connectome, ('indices', 'offsets')))
+
 
 class BaseArea:
     __slots__ = ('space', 'indexes')
 
     def __init__(self, node, min_distance=1, max_distance=None):
+        self.space = node.space
+
+        connectome = self.get_connectome(self.space.topology, min_distance, max_distance)
+
+        # area of single node is read as python list, which is much faster to iterate than array slice
+        self.indexes = connectome[node.index].tolist()
+
+    @classmethod
+    def get_connectome(cls, topology, min_distance=1, max_distance=None, dense=False):
         if max_distance is None:
             max_distance = min_distance
 
-        self.space = node.space
+        connectomes = topology.connectomes
+
+        connectome_uid = (cls.__name__, min_distance, max_distance)
+
+        connectome = connectomes.get(connectome_uid)
+
+        # policy is needed only to build missing connectomes
+        policy = connectomes.policy(connectome_uid) if connectome is None or dense else None
+
+        if connectome is None:
+            if policy == EAGER:
+                key = connectomes.disk_key(topology, cls, connectome_uid, min_distance, max_distance)
+
+                connectome = connectomes.load(key)
+
+                if connectome is None:
+                    connectome = compact(cls.connectome(topology, min_distance, max_distance))
+                    connectomes.store(key, connectome)
+            else:
+                connectome = LazyConnectome(topology,
+                                            cls.template(min_distance, max_distance),
+                                            keep=policy == LAZY)
+
+            if policy != TRANSIENT:
+                connectomes[connectome_uid] = connectome
 
-        connectome_uid = (self.__class__.__name__, min_distance, max_distance)
+        if dense and not isinstance(connectome, DenseConnectome):
+            dense_uid = connectome_uid + ('dense',)
 
-        if connectome_uid not in self.space.topology.connectomes:
-            connectome = self.connectome(self.space.topology, min_distance, max_distance)
-            self.space.topology.connectomes[connectome_uid] = connectome
-        else:
-            connectome = self.space.topology.connectomes[connectome_uid]
+            dense_connectome = connectomes.get(dense_uid)
 
-        self.indexes = connectome[node.index]
+            dense_key = None
 
-    def connectome(self, topology, min_distance, max_distance):
+            if dense_connectome is None and policy == EAGER:
+                dense_key = connectomes.disk_key(topology, cls, dense_uid, min_distance, max_distance)
+                dense_connectome = connectomes.load(dense_key)
+
+            if dense_connectome is None:
+                dense_connectome = connectome.dense()
+                connectomes.store(dense_key, dense_connectome)
+
+            if policy != TRANSIENT:
+                connectomes[dense_uid] = dense_connectome
+
+            connectome = dense_connectome
+
+        return connectome
+
+    @classmethod
+    def template(cls, min_distance, max_distance):
         raise NotImplementedError('must be overriden in child classes')
 
+    @classmethod
+    def connectome(cls, topology, min_distance, max_distance):
+        return topology.connectome(cls.template(min_distance, max_distance))
+
     def base(self, *filters):
-        return self.space.base(*filters, indexes=self.indexes)
+        return Selection(self.space.base(*filters, indexes=self.indexes), total=len(self.indexes))
 
     def new(self, *filters):
-        return self.space.new(*filters, indexes=self.indexes)
+        return Selection(self.space.new(*filters, indexes=self.indexes), total=len(self.indexes))
 
     def actual(self, *filters):
-        return self.space.actual(*filters, indexes=self.indexes)
+        return Selection(self.space.actual(*filters, indexes=self.indexes), total=len(self.indexes))
+
+
+class Selection:
+    __slots__ = ('nodes', 'total')
+
+    # nodes chosen from area together with total size of the area
+    def __init__(self, nodes, total=None):
+        self.nodes = nodes
+        self.total = total
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __next__(self):
+        return next(self.nodes)
+
+    @classmethod
+    def materialize(cls, other):
+        return cls(tuple(other), total=getattr(other, 'total', None))
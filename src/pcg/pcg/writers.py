@@ -0,0 +1,123 @@
+
+import queue
+import pathlib
+import threading
+
+from PIL import GifImagePlugin
+
+
+class Animation:
+    __slots__ = ('filename', 'duration', 'frames')
+
+    # keeps all frames in memory and encodes them at the end, format is chosen by filename
+    def __init__(self, filename, duration):
+        self.filename = filename
+        self.duration = duration
+        self.frames = []
+
+    def write(self, frame):
+        self.frames.append(frame)
+
+    def close(self):
+        self.frames[0].save(self.filename,
+                            lossles=True,
+                            quality=100,
+                            duration=self.duration,
+                            save_all=True,
+                            append_images=self.frames[1:])
+
+
+class Gif:
+    __slots__ = ('filename', 'duration', 'loop', '_file')
+
+    # encodes every frame as soon as it arrives, only the current frame is kept in memory
+    def __init__(self, filename, duration, loop=0):
+        self.filename = filename
+        self.duration = duration
+        self.loop = loop
+        self._file = None
+
+    def write(self, frame):
+        frame = frame.convert('RGB').quantize(256)
+
+        if self._file is None:
+            self._file = open(self.filename, 'wb')
+
+            header, _ = GifImagePlugin.getheader(frame, info={'loop': self.loop})
+
+            for chunk in header:
+                self._file.write(chunk)
+
+        for chunk in GifImagePlugin.getdata(frame, duration=self.duration, include_color_table=True):
+            self._file.write(chunk)
+
+    def close(self):
+        if self._file is None:
+            return
+
+        self._file.write(b';')
+        self._file.close()
+        self._file = None
+
+
+class Directory:
+    __slots__ = ('path', 'pattern', 'written')
+
+    def __init__(self, path, pattern='frame_{:06}.png'):
+        self.path = pathlib.Path(path)
+        self.pattern = pattern
+        self.written = 0
+
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def write(self, frame):
+        frame.save(self.path / self.pattern.format(self.written))
+        self.written += 1
+
+    def close(self):
+        pass
+
+
+class Background:
+    __slots__ = ('writer', '_queue', '_thread', '_error')
+
+    _STOP = object()
+
+    # encodes frames in separate thread, queue size limits number of frames waiting in memory
+    def __init__(self, writer, queue_size=2):
+        self.writer = writer
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            frame = self._queue.get()
+
+            if frame is self._STOP:
+                return
+
+            if self._error is not None:
+                continue
+
+            try:
+                self.writer.write(frame)
+            except Exception as error:
+                self._error = error
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, frame):
+        self._check()
+        self._queue.put(frame)
+
+    def close(self):
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+        self._check()
+
+        self.writer.close()
@@ -14,6 +14,6 @@ setuptools.setup(
     classifiers=[],
     keywords=[],
     packages=setuptools.find_packages(),
-    install_requires=[],
+    install_requires=['numpy'],
 
     include_package_data=True)
@@ -0,0 +1,100 @@
+
+import multiprocessing
+
+import numpy
+import pytest
+
+from pcg import nodes
+from pcg import pipelines
+from pcg.space import Space
+from pcg.filters import Fraction
+from pcg.parallel import Executor
+from pcg.pipelines import Rule, Pipeline
+from pcg.aggregators import Between, Count
+from pcg.grids import square
+
+
+pytestmark = pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(),
+                                reason='parallel executor requires fork start method')
+
+
+FABRIC = nodes.Fabric()
+DEAD = FABRIC.Property('state')
+ALIVE = FABRIC.Property('state')
+
+
+def create_space():
+    space = Space(square.RectangleTopology(120, 90, wrap=True), seed=7)
+    space.initialize(FABRIC.Node(DEAD))
+    return space
+
+
+def life(space, indexes):
+    # fractions are created inside rule, so every tile of every worker creates its own ones
+    alive = space.mask(ALIVE, indexes=indexes)
+    counts = space.count_neighbours(square.Ring, ALIVE)[indexes]
+
+    space.assign(indexes[alive & ((counts < 2) | (3 < counts))], DEAD)
+    space.assign(indexes[~alive & (counts == 3)], ALIVE)
+    space.assign(indexes[space.mask(Fraction(0.01), indexes=indexes)], ALIVE)
+    space.assign(indexes[space.mask(Fraction(0.01), indexes=indexes)], DEAD)
+
+
+def run_executor(processes, steps=5):
+    space = create_space()
+
+    with space.step():
+        space.assign(space.mask(Fraction(0.3)), ALIVE)
+
+    if processes is None:
+        for _ in range(steps):
+            with space.step():
+                life(space, numpy.arange(space.size()))
+
+        return space.columns().copy()
+
+    with Executor(space, processes=processes) as executor:
+        for _ in range(steps):
+            with space.step():
+                executor.run(life)
+
+    return space.columns().copy()
+
+
+def run_pipeline(processes, steps=5):
+    space = create_space()
+
+    pipeline = Pipeline(space, processes=processes)
+
+    pipeline.add(Rule(ALIVE, selectors=(Fraction(0.3),)))
+    pipeline.add(Rule(DEAD, selectors=(ALIVE,), area=square.Ring, filter=ALIVE, aggregator=~Between(2, 3)),
+                 Rule(ALIVE, selectors=(DEAD,), area=square.Ring, filter=ALIVE, aggregator=Count(3)),
+                 Rule(ALIVE, selectors=(Fraction(0.01), DEAD)),
+                 repeat=steps)
+
+    pipeline.run()
+
+    return space.columns().copy(), pipeline.engines
+
+
+@pytest.mark.parametrize('processes', [2, 3])
+def test_executor_matches_serial_run(processes):
+    assert (run_executor(processes) == run_executor(None)).all()
+
+
+def test_serial_runs_are_repeatable():
+    assert (run_executor(None) == run_executor(None)).all()
+
+
+@pytest.mark.parametrize('processes', [2, 3])
+def test_parallel_pipeline_matches_serial_run(monkeypatch, processes):
+    serial, engines = run_pipeline(1)
+
+    assert pipelines.PARALLEL not in engines
+
+    monkeypatch.setattr(pipelines, 'PARALLEL_THRESHOLD', 0)
+
+    parallel, engines = run_pipeline(processes)
+
+    assert pipelines.PARALLEL in engines
+    assert (parallel == serial).all()